@@ -1,14 +1,19 @@
+import functools
 import logging
-import json
+import math
+import os
 import random
+import re
 import asyncio
-from typing import List, Dict, Any, Annotated, Optional
-from pathlib import Path
+from collections import deque
+from typing import List, Annotated, Optional
 
+import orjson
 from dotenv import load_dotenv
 
 from livekit.agents import (
     Agent,
+    APIConnectOptions,
     AgentSession,
     JobContext,
     JobProcess,
@@ -20,7 +25,7 @@ from livekit.agents import (
     tokenize,
     function_tool,
 )
-from livekit.plugins import murf, silero, google, deepgram, noise_cancellation
+from livekit.plugins import murf, silero, google, deepgram, noise_cancellation, openai
 from livekit.plugins.turn_detector.multilingual import MultilingualModel
 
 logger = logging.getLogger("improv-agent")
@@ -28,75 +33,171 @@ logger = logging.getLogger("improv-agent")
 # Load environment
 load_dotenv(".env.local")
 
+# ============================================================
+# TTS TOKENIZATION
+# ============================================================
+
+# A '.' only terminates a sentence when it isn't glued to a word character
+# (decimals like 9.5, acronyms, websites) and doesn't follow a title prefix,
+# so scoring phrases like "9.5 out of 10" stay in one TTS dispatch
+_SENTENCE_RE = re.compile(
+    r"(?:[^.!?\n]"  # any non-terminator character
+    r"|\.(?=\w)"  # '.' followed by a word char: 9.5, U.S.A, murf.ai
+    r"|(?:(?<=\bMr)|(?<=\bMrs)|(?<=\bMs)|(?<=\bDr)|(?<=\bProf)|(?<=\bSt)|(?<=\bvs))\."
+    r")+"
+    r"[.!?\n]*",
+    re.S,
+)
+
+def _split_sentences(text: str, min_sentence_len: int = 20) -> List[tuple]:
+    """Regex-based drop-in for the basic splitter. Returns (sentence, start,
+    end) tuples; sentences shorter than min_sentence_len are merged into the
+    following one (mirroring the basic tokenizer) so no text is dropped."""
+    tokens = []
+    buf_start = buf_end = -1
+    for m in _SENTENCE_RE.finditer(text):
+        if buf_start < 0:
+            buf_start = m.start()
+        buf_end = m.end()
+        chunk = text[buf_start:buf_end].strip()
+        if len(chunk) >= min_sentence_len:
+            tokens.append((chunk, buf_start, buf_end))
+            buf_start = -1
+    if buf_start >= 0:
+        # Trailing chunk below the threshold or an unterminated sentence:
+        # emit it rather than dropping it; the buffered stream holds the
+        # last token back until more text arrives or the stream is flushed
+        chunk = text[buf_start:buf_end].strip()
+        if chunk:
+            tokens.append((chunk, buf_start, buf_end))
+    return tokens
+
+class FastSentenceTokenizer(tokenize.basic.SentenceTokenizer):
+    """Sentence tokenizer whose splitting runs in a precompiled regex instead
+    of the basic tokenizer's per-character Python scan. Sentence splitting
+    sits on the streaming hot path (one TTS dispatch per sentence), so both
+    tokenize() and the buffered stream go through the regex splitter."""
+
+    def __init__(self, *, min_sentence_len: int = 20, stream_context_len: int = 10) -> None:
+        super().__init__(
+            min_sentence_len=min_sentence_len,
+            stream_context_len=stream_context_len,
+        )
+        self._min_len = min_sentence_len
+        self._ctx_len = stream_context_len
+
+    def tokenize(self, text: str, *, language: Optional[str] = None) -> List[str]:
+        return [tok[0] for tok in _split_sentences(text, min_sentence_len=self._min_len)]
+
+    def stream(self, *, language: Optional[str] = None) -> tokenize.SentenceStream:
+        return tokenize.token_stream.BufferedSentenceStream(
+            tokenizer=functools.partial(_split_sentences, min_sentence_len=self._min_len),
+            min_token_len=self._min_len,
+            min_ctx_len=self._ctx_len,
+        )
+
 # ============================================================
 # GAME STATE & LOGIC
 # ============================================================
 
-SCENARIOS = [
+# Read-only scenario pool; a tuple keeps this shared global immutable
+SCENARIOS = (
     "You are a time-travelling tour guide explaining modern smartphones to someone from the 1800s.",
     "You are a restaurant waiter who must calmly tell a customer that their order has escaped the kitchen.",
     "You are a customer trying to return an obviously cursed object to a very skeptical shop owner.",
     "You are a cat trying to convince a dog to let you share the bed.",
     "You are a superhero whose only power is making toast slightly faster, interviewing for the Avengers.",
     "You are a alien trying to explain to your leader why you failed to conquer Earth (it was the pizza).",
-]
+)
+
+# Optional JIT-compiled scorer over per-round reaction lengths, used for the
+# end-of-game summary. cache=True persists the compiled artifact so later
+# process starts skip the first-compile cost. Falls back to plain Python when
+# numba/numpy are not installed.
+try:
+    import numpy as np
+    from numba import njit
+
+    @njit(cache=True)
+    def _score_rounds(arr):
+        s = 0.0
+        for i in range(arr.shape[0]):
+            s += arr[i] * 0.7 + np.log1p(arr[i])
+        return s
+except ImportError:
+    np = None
+
+    def _score_rounds(arr):
+        return sum(x * 0.7 + math.log1p(x) for x in arr)
 
 class ImprovGame:
+    # Fixed-schema state holder instantiated per job; slots drop the
+    # per-instance __dict__ and speed up attribute access in the tool handlers
+    __slots__ = (
+        "_deck",
+        "current_round",
+        "current_scenario",
+        "max_rounds",
+        "phase",
+        "player_name",
+        "reactions",
+        "scenarios_played",
+    )
+
     def __init__(self):
         self.player_name: Optional[str] = None
         self.current_round: int = 0
         self.max_rounds: int = 3
-        self.rounds: List[Dict[str, str]] = [] # [{"scenario": ..., "reaction": ...}]
+        # Parallel per-round lists (read together via zip); dense arrays keep
+        # the end-of-game scoring loop cache-friendly
+        self.scenarios_played: List[str] = []
+        self.reactions: List[str] = []
         self.phase: str = "intro" # intro, playing, done
         self.current_scenario: Optional[str] = None
+        self._deck: deque = deque() # shuffled once per game, popped per round
 
     def start_game(self, name: str):
         self.player_name = name
         self.phase = "playing"
         self.current_round = 0
-        logger.info(f"Game started for {name}")
+        self._deck = deque(random.sample(SCENARIOS, len(SCENARIOS)))
+        logger.info("Game started for %s", name)
 
     def get_next_scenario(self) -> Optional[str]:
         if self.current_round >= self.max_rounds:
             self.phase = "done"
             return None
-        
+
         # Pick a random scenario that hasn't been used (if possible)
-        scenario = random.choice(SCENARIOS)
+        if not self._deck:
+            # Only happens if max_rounds exceeds the scenario pool: reshuffle
+            self._deck = deque(random.sample(SCENARIOS, len(SCENARIOS)))
+        scenario = self._deck.popleft()
         self.current_scenario = scenario
         self.current_round += 1
         return scenario
 
     def record_round(self, reaction: str):
         if self.current_scenario:
-            self.rounds.append({
-                "scenario": self.current_scenario,
-                "reaction": reaction
-            })
-            logger.info(f"Round {self.current_round} recorded. Reaction: {reaction}")
+            self.scenarios_played.append(self.current_scenario)
+            self.reactions.append(reaction)
+            # Reactions can be long; skip building the message entirely
+            # when INFO is filtered out
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Round %d recorded. Reaction: %s", self.current_round, reaction)
 
 # ============================================================
 # AGENT IMPLEMENTATION
 # ============================================================
 
-class ImprovHost(Agent):
-    def __init__(self, game: ImprovGame) -> None:
-        self.game = game
-        super().__init__(
-            instructions=self._prompt()
-        )
-
-    def _prompt(self):
-        return """
+# Base instructions are static so the same string object is reused by every
+# Agent in the process; live game state is appended separately per turn.
+_PROMPT_BASE = """
 You are the charismatic, high-energy, and witty host of "Improv Battle", a voice-first improv game show.
 
 **Your Goal:**
 Guide the player through 3 rounds of short-form improv. You set the scene, they act, and you react.
 
-**Current State:**
-- Player Name: {player_name}
-- Round: {current_round}/{max_rounds}
-
 **Persona:**
 - **Tone:** Energetic, sharp, slightly theatrical (think game show host).
 - **Style:** You are supportive but honest. If a joke falls flat, you can tease them playfully. If they are great, praise them enthusiastically.
@@ -124,18 +225,36 @@ Guide the player through 3 rounds of short-form improv. You set the scene, they
 - **ALWAYS** use the `get_scenario` tool to get the scenario text. Do not invent your own scenarios unless the tool fails.
 - **ALWAYS** use `record_round_reaction` after you deliver your feedback for a round.
 - If the user says "stop game" or "quit", politely end the show.
-""".format(
-    player_name=self.game.player_name or "Unknown",
-    current_round=self.game.current_round,
-    max_rounds=self.game.max_rounds
-)
+"""
+
+def _state_suffix(game: ImprovGame) -> str:
+    return f"\nSTATE: name={game.player_name or 'Unknown'} round={game.current_round}/{game.max_rounds}"
+
+class ImprovHost(Agent):
+    # Agent keeps its own __dict__; slotting our one attribute still gives
+    # it a C-level descriptor lookup
+    __slots__ = ("game", "rules_preamble")
+
+    # Prebuilt prefixes for the get_scenario tool return; sized well past
+    # max_rounds so a bigger game never indexes out of range
+    _ROUND_PREFIX = tuple(f"Scenario for Round {i}: " for i in range(1, 16))
+
+    def __init__(self, game: ImprovGame) -> None:
+        self.game = game
+        self.rules_preamble = (
+            "Rules: I'll give you a scenario, you act it out. When you're done, "
+            "say 'End Scene' or just stop talking, and I'll judge you."
+        )
+        super().__init__(
+            instructions=_PROMPT_BASE
+        )
 
     @function_tool
     async def set_player_name(self, name: Annotated[str, "The name of the player"]):
         """Call this when the player tells you their name."""
-        logger.info(f"Setting player name to {name}")
+        logger.info("Setting player name to %s", name)
         self.game.start_game(name)
-        return f"Player name set to {name}. Game started! Now explain the rules and start Round 1."
+        return f"Name {name} recorded. Call get_scenario now."
 
     @function_tool
     async def get_scenario(self):
@@ -143,7 +262,7 @@ Guide the player through 3 rounds of short-form improv. You set the scene, they
         try:
             scenario = self.game.get_next_scenario()
             if scenario:
-                return f"Scenario for Round {self.game.current_round}: {scenario}"
+                return ImprovHost._ROUND_PREFIX[self.game.current_round - 1] + scenario
             else:
                 return "GAME_OVER"
         except Exception as e:
@@ -160,75 +279,233 @@ Guide the player through 3 rounds of short-form improv. You set the scene, they
 # PREWARM
 # ============================================================
 
+# The no-name greeting never changes, so its audio can be rendered once per
+# process and replayed on connect instead of paying Murf's TTFB every job.
+DEFAULT_GREETING = "Welcome to Improv Battle! I'm your host. What's your name, contestant?"
+
+async def _synthesize_greeting() -> list:
+    # Uses a throwaway client: this runs in a temporary event loop during
+    # prewarm, and any connection opened here would be unusable (and
+    # poisonous) once that loop is closed
+    tts = murf.TTS(voice="en-US-matthew", style="Promo", text_pacing=True)
+    try:
+        frames = []
+        # No retries: a single attempt either fits the prewarm budget or we
+        # fall back to live synthesis
+        synth = tts.synthesize(
+            DEFAULT_GREETING,
+            conn_options=APIConnectOptions(max_retry=0, timeout=5.0),
+        )
+        async for audio in synth:
+            frames.append(audio.frame)
+        return frames
+    finally:
+        await tts.aclose()
+
+async def _replay_frames(frames: list):
+    for frame in frames:
+        yield frame
+
 def prewarm(proc: JobProcess):
     proc.userdata["vad"] = silero.VAD.load()
+    # Load the turn-detector weights once per process instead of per job;
+    # reloading them in entrypoint adds hundreds of ms to every cold start.
+    proc.userdata["turn_detector"] = MultilingualModel()
+    # One TTS client per process: after the first session connects it, the
+    # connection stays warm for every later job in this process. It must not
+    # be used here — prewarm has no long-lived event loop, and a connection
+    # bound to a dead loop would break the first real synthesize.
+    proc.userdata["tts"] = murf.TTS(
+        voice="en-US-matthew",
+        style="Promo",
+        tokenizer=FastSentenceTokenizer(min_sentence_len=2),
+        text_pacing=True,
+    )
+    try:
+        # Hard-bounded: the worker kills processes that exceed its init
+        # timeout, so a slow or unreachable Murf must not stall prewarm
+        proc.userdata["greeting_frames"] = asyncio.run(
+            asyncio.wait_for(_synthesize_greeting(), timeout=5)
+        )
+    except Exception as e:
+        # Non-fatal: entrypoint falls back to live synthesis of the greeting
+        logger.warning(f"Greeting pre-synthesis failed: {e}")
+        proc.userdata["greeting_frames"] = None
 
 # ============================================================
 # ENTRYPOINT
 # ============================================================
 
+def build_llm():
+    """Build the session LLM from env, so deployments can swap in a
+    faster-TTFT backend (any OpenAI-compatible endpoint) without code
+    changes."""
+    backend = os.environ.get("LLM_BACKEND", "google")
+    if backend == "google":
+        return google.LLM(
+            model=os.environ.get("LLM_MODEL", "gemini-2.5-flash"),
+            location=os.environ.get("GOOGLE_VERTEX_LOCATION", "us-central1"),
+        )
+    # Groq/Together/Fireworks/self-hosted vLLM via the OpenAI-compatible API
+    return openai.LLM(
+        base_url=os.environ.get("LLM_BASE_URL"),
+        api_key=os.environ.get("LLM_API_KEY"),
+        model=os.environ.get("LLM_MODEL", "gpt-4o-mini"),
+    )
+
 async def entrypoint(ctx: JobContext):
     ctx.log_context_fields = {"room": ctx.room.name}
     
     game = ImprovGame()
 
     # Try to get player name from metadata
-    initial_greeting = "Welcome to Improv Battle! I'm your host. What's your name, contestant?"
+    initial_greeting = DEFAULT_GREETING
     
     # Wait a bit for participants to be populated if needed, though usually they are there on connect
     # But let's check existing participants
     for p in ctx.room.remote_participants.values():
-        if p.metadata:
-            try:
-                md = json.loads(p.metadata)
-                if "player_name" in md and md["player_name"]:
-                    game.start_game(md["player_name"])
-                    initial_greeting = f"Welcome to Improv Battle, {game.player_name}! I'm your host. Are you ready to improvise?"
-                    break
-            except Exception as e:
-                logger.warning(f"Failed to parse metadata: {e}")
+        md_bytes = p.metadata.encode() if isinstance(p.metadata, str) else p.metadata
+        # Anonymous guests commonly carry empty or non-JSON metadata; skip
+        # them cheaply instead of paying for a raised JSONDecodeError.
+        if not md_bytes or md_bytes[:1] != b"{":
+            continue
+        try:
+            md = orjson.loads(md_bytes)
+        except orjson.JSONDecodeError as e:
+            logger.warning(f"Failed to parse metadata: {e}")
+            continue
+        if "player_name" in md and md["player_name"]:
+            game.start_game(md["player_name"])
+            initial_greeting = f"Welcome to Improv Battle, {game.player_name}! I'm your host. Are you ready to improvise?"
+            break
+
+    # Pin STT/LLM endpoints to a region colocated with the deployment;
+    # provider-side routing distance dominates TTFT otherwise
+    stt_kwargs = {
+        "model": "nova-3",
+        # Aggressive endpointing: surface finals fast and let the turn
+        # detector + preemptive_generation handle actual turn taking
+        "endpointing_ms": 25,
+        "interim_results": True,
+        "smart_format": False,
+        "no_delay": True,
+    }
+    # Only override the endpoint when a region is explicitly configured;
+    # otherwise stick with the plugin's default api.deepgram.com
+    deepgram_region = os.environ.get("DEEPGRAM_REGION")
+    if deepgram_region:
+        stt_kwargs["base_url"] = f"wss://api-{deepgram_region}.deepgram.com/v1/listen"
 
     session = AgentSession(
-        stt=deepgram.STT(model="nova-3"),
-        llm=google.LLM(model="gemini-2.5-flash"),
-        tts=murf.TTS(
-            voice="en-US-matthew", 
-            style="Promo", 
-            tokenizer=tokenize.basic.SentenceTokenizer(min_sentence_len=2),
-            text_pacing=True,
-        ),
+        stt=deepgram.STT(**stt_kwargs),
+        llm=build_llm(),
+        tts=ctx.proc.userdata["tts"],
         vad=ctx.proc.userdata["vad"],
-        turn_detection=MultilingualModel(),
+        turn_detection=ctx.proc.userdata["turn_detector"],
         preemptive_generation=True,
+        min_endpointing_delay=0.05,
     )
 
+    host = ImprovHost(game)
+
+    # Refresh the instructions with live game state, but only when the round
+    # actually changes — the base prompt itself never needs rebuilding.
+    last_round = game.current_round
+    # Keep strong references so in-flight updates can't be garbage-collected
+    pending_updates: set = set()
+
+    def _update_done(task: asyncio.Task):
+        pending_updates.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Failed to refresh instructions: %s", task.exception())
+
+    @session.on("user_input_transcribed")
+    def _refresh_state(_event):
+        nonlocal last_round
+        if game.current_round != last_round:
+            last_round = game.current_round
+            task = asyncio.create_task(
+                host.update_instructions(_PROMPT_BASE + _state_suffix(game))
+            )
+            pending_updates.add(task)
+            task.add_done_callback(_update_done)
+
     # Track usage
     usage = metrics.UsageCollector()
 
+    # Metric events are queued and logged in batches from a background task,
+    # keeping logger I/O out of the event-loop callback shared with audio
+    metrics_q: asyncio.Queue = asyncio.Queue()
+
     @session.on("metrics_collected")
     def _on(event: MetricsCollectedEvent):
-        metrics.log_metrics(event.metrics)
+        metrics_q.put_nowait(event.metrics)
         usage.collect(event.metrics)
 
+    async def _drain_metrics():
+        while True:
+            batch = [await metrics_q.get()]
+            while not metrics_q.empty():
+                batch.append(metrics_q.get_nowait())
+            for m in batch:
+                metrics.log_metrics(m)
+
+    drain_task = asyncio.create_task(_drain_metrics())
+
     async def finish():
+        # Flush anything still queued before tearing the drain task down
+        drain_task.cancel()
+        while not metrics_q.empty():
+            metrics.log_metrics(metrics_q.get_nowait())
+        # Post-session scoring runs off the critical path during shutdown
+        if game.reactions:
+            if np is not None:
+                lengths = np.fromiter(
+                    (len(r) for r in game.reactions), dtype=np.int32
+                )
+            else:
+                lengths = [len(r) for r in game.reactions]
+            logger.info(
+                "Final performance score for %s: %.1f",
+                game.player_name,
+                _score_rounds(lengths),
+            )
         logger.info(usage.get_summary())
 
     ctx.add_shutdown_callback(finish)
 
-    await session.start(
-        agent=ImprovHost(game),
-        room=ctx.room,
-        room_input_options=RoomInputOptions(
-            noise_cancellation=noise_cancellation.BVC()
+    # Agent boot and WebRTC negotiation are both I/O-bound; overlapping them
+    # shaves the shorter of the two off time-to-first-audio.
+    await asyncio.gather(
+        session.start(
+            agent=host,
+            room=ctx.room,
+            room_input_options=RoomInputOptions(
+                noise_cancellation=noise_cancellation.BVC()
+            ),
         ),
+        ctx.connect(),
     )
 
-    await ctx.connect()
-
-    await session.say(
-        initial_greeting,
-        add_to_chat_ctx=True
-    )
+    # Preload the rules into chat context so announcing them and starting
+    # Round 1 fits in the single LLM turn that follows set_player_name
+    rules_ctx = host.chat_ctx.copy()
+    rules_ctx.add_message(role="system", content=host.rules_preamble)
+    await host.update_chat_ctx(rules_ctx)
+
+    greeting_frames = ctx.proc.userdata.get("greeting_frames")
+    if initial_greeting is DEFAULT_GREETING and greeting_frames:
+        # Replay the audio cached at prewarm instead of round-tripping TTS
+        await session.say(
+            initial_greeting,
+            audio=_replay_frames(greeting_frames),
+            add_to_chat_ctx=True
+        )
+    else:
+        await session.say(
+            initial_greeting,
+            add_to_chat_ctx=True
+        )
 
 if __name__ == "__main__":
     cli.run_app(
@@ -1,7 +1,7 @@
 import pytest
 from livekit.agents import AgentSession, inference, llm
 
-from agent import Assistant
+from agent import ImprovGame, ImprovHost
 
 
 def _llm() -> llm.LLM:
@@ -15,7 +15,7 @@ async def test_offers_assistance() -> None:
         _llm() as llm,
         AgentSession(llm=llm) as session,
     ):
-        await session.start(Assistant())
+        await session.start(ImprovHost(ImprovGame()))
 
         # Run an agent turn following the user's greeting
         result = await session.run(user_input="Hello")
@@ -30,7 +30,7 @@ async def test_offers_assistance() -> None:
                 Greets the user in a friendly manner.
 
                 Optional context that may or may not be included:
-                - Offer of assistance with any request the user may have
+                - Asking for the player's name or welcoming them to the game show
                 - Other small talk or chit chat is acceptable, so long as it is friendly and not too intrusive
                 """,
             )
@@ -40,6 +40,46 @@ async def test_offers_assistance() -> None:
         result.expect.no_more_events()
 
 
+@pytest.mark.asyncio
+async def test_name_turn_starts_round_one() -> None:
+    """Evaluation that hearing the name yields rules and Round 1 in a single turn."""
+    async with (
+        _llm() as llm,
+        AgentSession(llm=llm) as session,
+    ):
+        await session.start(ImprovHost(ImprovGame()))
+
+        # Run an agent turn following the user giving their name
+        result = await session.run(user_input="Hi, my name is Jordan.")
+
+        # The name is recorded and the first scenario fetched without an
+        # intervening assistant turn
+        result.expect.next_event().is_function_call(
+            name="set_player_name", arguments={"name": "Jordan"}
+        )
+        result.expect.next_event().is_function_call_output()
+        result.expect.next_event().is_function_call(name="get_scenario")
+        result.expect.next_event().is_function_call_output()
+
+        # Evaluate that the single spoken response covers name, rules, and scenario
+        await (
+            result.expect.next_event()
+            .is_message(role="assistant")
+            .judge(
+                llm,
+                intent="""
+                Welcomes the player (ideally by name), explains the game rules
+                (the player acts out a scenario and says 'End Scene' or stops
+                talking when done), announces the Round 1 scenario, and tells
+                the player to begin.
+                """,
+            )
+        )
+
+        # Ensures the turn ends here, with no second round trip for the rules
+        result.expect.no_more_events()
+
+
 @pytest.mark.asyncio
 async def test_grounding() -> None:
     """Evaluation of the agent's ability to refuse to answer when it doesn't know something."""
@@ -47,7 +87,7 @@ async def test_grounding() -> None:
         _llm() as llm,
         AgentSession(llm=llm) as session,
     ):
-        await session.start(Assistant())
+        await session.start(ImprovHost(ImprovGame()))
 
         # Run an agent turn following the user's request for information about their birth city (not known by the agent)
         result = await session.run(user_input="What city was I born in?")
@@ -89,7 +129,7 @@ async def test_refuses_harmful_request() -> None:
         _llm() as llm,
         AgentSession(llm=llm) as session,
     ):
-        await session.start(Assistant())
+        await session.start(ImprovHost(ImprovGame()))
 
         # Run an agent turn following an inappropriate request from the user
         result = await session.run(